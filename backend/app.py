@@ -1,8 +1,15 @@
 import re
 import random
 import os
+import hashlib
+import threading
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from fastapi import FastAPI, Header, HTTPException, Body, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from typing import Optional
 from pydantic import BaseModel, EmailStr
 from supabase import create_client
@@ -23,36 +30,59 @@ import uuid
 
 load_dotenv()
 
+
+class LazyClient:
+    """
+    Build a client on first attribute access and share it afterwards.
+
+    Keeps importing this module free of network calls, so uvicorn workers
+    boot instantly and offline tools (e.g. backfill.py) can import it.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
 # Supabase setup
 env_url = os.getenv("SUPABASE_URL")
 env_key = os.getenv("SUPABASE_ANON_KEY")
-supabase = create_client(env_url, env_key)
-try:
-    supabase.table("user_table").select("user_id").limit(1).execute()
-    print("✅ Connected to Supabase")
-except Exception as e:
-    print("❌ Supabase connection failed:", e)
+supabase = LazyClient(lambda: create_client(env_url, env_key))
 
 service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-supabase_svc = create_client(env_url, service_key)
+supabase_svc = LazyClient(lambda: create_client(env_url, service_key))
 
-# MongoDB setup
+# MongoDB setup (MongoClient keeps its own connection pool)
 mongo_url = os.getenv("MONGODB_URL")
-mongo_client = MongoClient(mongo_url)
-try:
-    mongo_client.server_info()
-    print("✅ Connected to MongoDB")
-except Exception as e:
-    print("❌ MongoDB connection failed:", e)
+mongo_client = LazyClient(
+    lambda: MongoClient(mongo_url, serverSelectionTimeoutMS=5000)
+)
 
-memdb = mongo_client.major_project
-ip_memory = memdb.memory
+memdb = LazyClient(lambda: mongo_client.major_project)
 
 app = FastAPI()
 
 # bcrypt context for hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# Bounded pool for bcrypt so a burst of hashes can't hog the event loop
+# or the request threadpool
+hash_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HASH_WORKERS", os.cpu_count() or 2)),
+    thread_name_prefix="bcrypt",
+)
+
 
 def hash_password(password: str) -> str:
     """
@@ -84,6 +114,20 @@ def hash_password(password: str) -> str:
             raise
 
 
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password on the bcrypt pool without blocking the event loop.
+
+    Args:
+        password: The plain text password to hash
+
+    Returns:
+        The hashed password as a string
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(hash_pool, hash_password, password)
+
+
 class RegisterUser(BaseModel):
     username: str
     email: EmailStr
@@ -101,7 +145,8 @@ class RegisterAdmin(BaseModel):
 
 
 def extract_datetime(line):
-    m = re.search(r"^(\w{3} \d{1,2} \d{2}:\d{2}:\d{2})", line)
+    # syslog pads single-digit days with a space ("Jul  1 00:21:28")
+    m = re.search(r"^(\w{3}\s+\d{1,2} \d{2}:\d{2}:\d{2})", line)
     return m.group(1) if m else None
 
 
@@ -119,9 +164,16 @@ def within_10_seconds(t1, t2):
 # Core classifier
 
 
-def classify_line(line, device_id=None):
-    dt = extract_datetime(line)
-    log_dt = datetime.strptime(dt, "%b %d %H:%M:%S") if dt else None
+def classify_line(line, device_id=None, now=None, log_dt=None, db=None):
+    # log_dt: the line's parsed timestamp, if the caller already has one
+    # db: Mongo database for the detection state (backfills use a scratch one)
+    db = memdb if db is None else db
+    if log_dt is None:
+        dt = extract_datetime(line)
+        try:
+            log_dt = datetime.strptime(dt, "%b %d %H:%M:%S") if dt else None
+        except ValueError:
+            log_dt = None  # e.g. Feb 29, which has no year to land in
     ip = extract_ip(line)
     anomaly = "No"
     log_type = "Normal"
@@ -140,52 +192,54 @@ def classify_line(line, device_id=None):
     if "sshd" in line and "authentication failure" in line:
         log_type = "Auth Failure"
         if ip and log_dt:
-            rec = ip_memory.find_one({"ip": ip})
+            rec = db.memory.find_one({"ip": ip})
             if rec:
                 if within_10_seconds(log_dt, rec["last_seen"]):
                     count = rec["count"] + 1
-                    ip_memory.update_one(
+                    db.memory.update_one(
                         {"ip": ip}, {"$set": {"last_seen": log_dt, "count": count}}
                     )
                     if count > 3:
                         anomaly = "Yes"
                 else:
-                    ip_memory.update_one(
+                    db.memory.update_one(
                         {"ip": ip}, {"$set": {"last_seen": log_dt, "count": 1}}
                     )
             else:
-                ip_memory.insert_one({"ip": ip, "last_seen": log_dt, "count": 1})
+                db.memory.insert_one({"ip": ip, "last_seen": log_dt, "count": 1})
 
         if ip and log_dt:
-            history = memdb.failed_attempts.find_one({"ip": ip})
+            history = db.failed_attempts.find_one({"ip": ip})
             times = history["times"] if history else []
-            times = [
-                t
-                for t in times
-                if (log_dt - datetime.strptime(t, "%Y-%m-%d %H:%M:%S")).total_seconds()
-                <= 86400
-            ]
-            times.append(log_dt.strftime("%Y-%m-%d %H:%M:%S"))
-            memdb.failed_attempts.update_one(
+            # The stamps sort as strings, so the 24h window is a string range
+            newest = log_dt.strftime("%Y-%m-%d %H:%M:%S")
+            oldest = (log_dt - timedelta(seconds=86400)).strftime("%Y-%m-%d %H:%M:%S")
+            # Stamps after this line (other devices, out-of-order lines) are kept,
+            # but only the ones up to it count towards this line's window
+            times = [t for t in times if oldest <= t]
+            times.append(newest)
+            db.failed_attempts.update_one(
                 {"ip": ip}, {"$set": {"times": times}}, upsert=True
             )
-            if len(times) > 20:
+            if sum(1 for t in times if t <= newest) > 20:
                 anomaly = "Yes"
 
     if "sshd" in line and "Accepted password" in line:
         log_type = "Successful Login"
         if ip:
-            rec = memdb.failed_attempts.find_one({"ip": ip})
+            rec = db.failed_attempts.find_one({"ip": ip})
             if rec and len(rec.get("times", [])) > 3:
                 anomaly = "Yes"
-                memdb.failed_attempts.delete_one({"ip": ip})
+                db.failed_attempts.delete_one({"ip": ip})
 
     if ip and log_dt:
-        now = datetime.utcnow()
-        memdb.access_attempts.insert_one({"ip": ip, "timestamp": now})
+        # Backfills pass the line's own timestamp so the burst window is not
+        # measured against import speed
+        now = now or datetime.utcnow()
+        db.access_attempts.insert_one({"ip": ip, "timestamp": now})
         recent = list(
-            memdb.access_attempts.find(
-                {"timestamp": {"$gte": now - timedelta(seconds=5)}}
+            db.access_attempts.find(
+                {"timestamp": {"$gte": now - timedelta(seconds=5), "$lte": now}}
             )
         )
         unique_ips = len(set(r["ip"] for r in recent))
@@ -199,6 +253,20 @@ def classify_line(line, device_id=None):
     return anomaly, log_type
 
 
+def build_log_row(line, log_dt, device_id, now=None, db=None):
+    status, ltype = classify_line(line, device_id, now, log_dt, db)
+    return {
+        "logs": line,
+        "ip_address": extract_ip(line),
+        "log_date": log_dt.strftime("%Y-%m-%d"),
+        "log_time": log_dt.strftime("%H:%M:%S"),
+        "log_type": ltype,
+        "anomaly_detected": status,
+        "device_id": device_id,
+        "suspicious_check": False,
+    }
+
+
 # ShortTermMemory
 
 
@@ -207,31 +275,122 @@ class ShortTermMemory:
         self.memory = {}  # { ip: (score, ttl) }
         self.threshold = threshold
         self.ttl_limit = ttl_limit
+        # process_logs runs on threadpool workers, so guard every access
+        self.lock = threading.Lock()
 
     def update(self, ip_scores):
-        for ip, score in ip_scores.items():
-            if score >= self.threshold:
-                self.memory[ip] = (score, self.ttl_limit)
+        with self.lock:
+            for ip, score in ip_scores.items():
+                if score >= self.threshold:
+                    self.memory[ip] = (score, self.ttl_limit)
 
     def decay(self):
-        to_remove = []
-        for ip, (score, ttl) in self.memory.items():
-            ttl -= 1
-            if ttl <= 0:
-                to_remove.append(ip)
-            else:
-                self.memory[ip] = (score, ttl)
-        for ip in to_remove:
-            del self.memory[ip]
+        with self.lock:
+            for ip, (score, ttl) in list(self.memory.items()):
+                ttl -= 1
+                if ttl <= 0:
+                    del self.memory[ip]
+                else:
+                    self.memory[ip] = (score, ttl)
 
     def get_suspicious_ips(self):
-        return self.memory
+        with self.lock:
+            return dict(self.memory)
 
 
 # Global memory instance
 memory = ShortTermMemory()
 
 
+# IngestWatermarks
+
+
+def line_digest(line):
+    return hashlib.sha1(line.encode("utf-8")).hexdigest()
+
+
+class IngestWatermarks:
+    # Each worker keeps its own cache, so marks are re-read from log_table once
+    # they are older than ttl seconds; this keeps workers that share a device
+    # from serving each other's stale watermark for long
+    def __init__(self, ttl=5.0):
+        self.marks = {}  # { device_id: (last_ts, {digests at last_ts}, loaded_at) }
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    def _load(self, device_id):
+        latest = (
+            supabase.table("log_table")
+            .select("log_date", "log_time")
+            .eq("device_id", device_id)
+            .order("log_date", desc=True)
+            .order("log_time", desc=True)
+            .limit(1)
+            .execute()
+            .data
+        )
+        if not latest:
+            return None, set(), time.monotonic()
+
+        last_ts = datetime.strptime(
+            f"{latest[0]['log_date']} {latest[0]['log_time']}", "%Y-%m-%d %H:%M:%S"
+        )
+        same_second = (
+            supabase.table("log_table")
+            .select("logs")
+            .eq("device_id", device_id)
+            .eq("log_date", latest[0]["log_date"])
+            .eq("log_time", latest[0]["log_time"])
+            .execute()
+            .data
+        )
+        digests = set(line_digest(r["logs"]) for r in same_second)
+        return last_ts, digests, time.monotonic()
+
+    @staticmethod
+    def _merge(current, last_ts, digests, loaded_at):
+        # Keep whichever watermark is newer; union digests if they share a second
+        old_ts, old_seen, _ = current
+        if old_ts is not None and (last_ts is None or last_ts < old_ts):
+            return old_ts, old_seen, loaded_at
+        if last_ts == old_ts:
+            digests = digests | old_seen
+        return last_ts, digests, loaded_at
+
+    def get(self, device_id):
+        with self.lock:
+            mark = self.marks.get(device_id)
+        if mark is None or time.monotonic() - mark[2] > self.ttl:
+            loaded = self._load(device_id)
+            # An advance() may have landed while _load was reading
+            with self.lock:
+                current = self.marks.get(device_id)
+                mark = loaded if current is None else self._merge(current, *loaded)
+                self.marks[device_id] = mark
+        return mark[0], set(mark[1])
+
+    def advance(self, device_id, inserted):
+        # inserted: [(log_dt, line)] that were just written to log_table
+        if not inserted:
+            return
+        newest = max(log_dt for log_dt, _ in inserted)
+        digests = set(line_digest(L) for log_dt, L in inserted if log_dt == newest)
+        with self.lock:
+            current = self.marks.get(device_id, (None, set(), float("-inf")))
+            self.marks[device_id] = self._merge(current, newest, digests, current[2])
+
+
+def is_new_line(line, log_dt, last_ts, seen):
+    # New if after the watermark, or at the watermark second with unseen content
+    if last_ts is None or log_dt > last_ts:
+        return True
+    return log_dt == last_ts and line_digest(line) not in seen
+
+
+# Global watermark cache
+watermarks = IngestWatermarks(ttl=float(os.getenv("WATERMARK_TTL", 5)))
+
+
 def process_logs(logs_batch):
     total_logs = len(logs_batch)
     if total_logs == 0:
@@ -285,6 +444,25 @@ def root():
     }
 
 
+@app.get("/ready")
+def ready():
+    checks = {}
+    try:
+        supabase.table("user_table").select("user_id").limit(1).execute()
+        checks["supabase"] = "ok"
+    except Exception as e:
+        checks["supabase"] = f"failed: {e}"
+    try:
+        mongo_client.admin.command("ping")
+        checks["mongodb"] = "ok"
+    except Exception as e:
+        checks["mongodb"] = f"failed: {e}"
+
+    if any(v != "ok" for v in checks.values()):
+        raise HTTPException(503, checks)
+    return checks
+
+
 @app.post("/register_user")
 def register_user(p: RegisterUser):
     # 1) Check username uniqueness
@@ -326,11 +504,11 @@ def register_user(p: RegisterUser):
     return {"device_id": device_id}
 
 
-@app.get("/device/{device_id}/last_log_time")
+# Plain text so the bash clients can compare it without stripping JSON quotes
+@app.get("/device/{device_id}/last_log_time", response_class=PlainTextResponse)
 def last_log_time(device_id: str):
-    r = supabase.table("log_table").select("log_time").eq("device_id", device_id)
-    r = r.order("created_at", desc=True).limit(1).execute()
-    return r.data[0]["log_time"] if r.data else "1970-01-01 00:00:00"
+    last_ts, _ = watermarks.get(device_id)
+    return last_ts.strftime("%Y-%m-%d %H:%M:%S") if last_ts else "1970-01-01 00:00:00"
 
 
 @app.post("/ingest_logs")
@@ -340,30 +518,15 @@ def ingest_logs(
     lines = logs.splitlines()
     print(lines)
     rows = []
+    inserted = []
     current_year = datetime.now().year
 
-    # Get latest timestamp from Supabase for this device
-    latest = (
-        supabase.table("log_table")
-        .select("log_date", "log_time")
-        .eq("device_id", x_device_id)
-        .order("log_date", desc=True)
-        .order("log_time", desc=True)
-        .limit(1)
-        .execute()
-        .data
-    )
-
-    last_ts = None
-    print("latest:", latest)
-    if latest:
-        last_ts = datetime.strptime(
-            f"{latest[0]['log_date']} {latest[0]['log_time']}", "%Y-%m-%d %H:%M:%S"
-        )
-        print("last_ts:", last_ts)
+    # Lines after the cached watermark are new; lines at the watermark second
+    # are new unless their content hash was already ingested
+    last_ts, seen = watermarks.get(x_device_id)
+    print("last_ts:", last_ts)
 
     for L in lines:
-        status, ltype = classify_line(L, x_device_id)
         dt_str = extract_datetime(L)
         if dt_str:
             try:
@@ -371,31 +534,19 @@ def ingest_logs(
                     f"{current_year} {dt_str}", "%Y %b %d %H:%M:%S"
                 )
                 print("log_dt:", log_dt)
-                if last_ts and log_dt <= last_ts:
-                    continue  # Skip older logs
-
-                date_str = log_dt.strftime("%Y-%m-%d")
-                time_str = log_dt.strftime("%H:%M:%S")
+                if not is_new_line(L, log_dt, last_ts, seen):
+                    continue  # Skip logs already ingested
             except ValueError:
                 continue  # Skip logs with bad datetime
         else:
             continue  # Skip logs with no datetime
 
-        rows.append(
-            {
-                "logs": L,
-                "ip_address": extract_ip(L),
-                "log_date": date_str,
-                "log_time": time_str,
-                "log_type": ltype,
-                "anomaly_detected": status,
-                "device_id": x_device_id,
-                "suspicious_check": False,
-            }
-        )
+        rows.append(build_log_row(L, log_dt, x_device_id))
+        inserted.append((log_dt, L))
 
     if rows:
         supabase.table("log_table").insert(rows).execute()
+        watermarks.advance(x_device_id, inserted)
 
     # Trigger process_logs only if 200+ logs are unprocessed
     res_count = (
@@ -588,7 +739,7 @@ def get_admin_logs_summary(admin_id: str, device_id: Optional[str] = None):
 
 @app.post("/process-logs")
 async def receive_logs(logs: List[dict]):
-    suspicious_ips = process_logs(logs)
+    suspicious_ips = await run_in_threadpool(process_logs, logs)
     return {"suspicious_ips": suspicious_ips}
 
 
@@ -608,11 +759,11 @@ async def create_admin(admin: RegisterAdmin):
 
         # 1️⃣ Check for existing email
         try:
-            exists = (
+            exists = await run_in_threadpool(
                 supabase_svc.table("admin_table")
                 .select("admin_id")
                 .eq("email", admin.email)
-                .execute()
+                .execute
             )
             print(f"Existing check result: {exists.data}")
         except Exception as e:
@@ -632,7 +783,7 @@ async def create_admin(admin: RegisterAdmin):
         # 2️⃣ Hash the password
         try:
             print(f"Hashing password for admin: {admin.email}")
-            hashed_pwd = hash_password(admin.password)
+            hashed_pwd = await hash_password_async(admin.password)
             print("Password hashing successful")
         except Exception as e:
             print(f"Error hashing password: {str(e)}")
@@ -668,7 +819,9 @@ async def create_admin(admin: RegisterAdmin):
 
             # Perform the insertion
             print("Executing insert operation...")
-            result = supabase_svc.table("admin_table").insert(admin_data).execute()
+            result = await run_in_threadpool(
+                supabase_svc.table("admin_table").insert(admin_data).execute
+            )
 
             print(f"Insert operation result: {result}")
 
@@ -687,9 +840,12 @@ async def create_admin(admin: RegisterAdmin):
             try:
                 if "admin_id" in locals():
                     print(f"Attempting to clean up admin_id: {admin_id}")
-                    supabase_svc.table("admin_table").delete().eq(
-                        "admin_id", admin_id
-                    ).execute()
+                    await run_in_threadpool(
+                        supabase_svc.table("admin_table")
+                        .delete()
+                        .eq("admin_id", admin_id)
+                        .execute
+                    )
             except Exception as cleanup_error:
                 print(f"Error during cleanup: {str(cleanup_error)}")
 
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# backfill.py: import historical syslog files straight into log_table, no HTTP
+#
+# Usage: python3 backfill.py --device-id <DEVICE_ID> FILE [FILE ...]
+#        [--year 2024] [--chunk-size 500] [--workers 4] [--force]
+#
+# Lines go through the same classify/insert pipeline as /ingest_logs, including
+# its dedup: lines at or before the device's watermark are skipped unless
+# --force is given, so re-running a backfill does not insert duplicates.
+#
+# Syslog has no year. Each file is dated on its own: a Nov/Dec -> Jan/Feb jump
+# starts the next year, and other large backward jumps are reported as
+# out-of-order input. Without --year the first year is picked so the last line
+# lands in the current year, or the year before if it would be in the future.
+#
+# Detection state (failed attempts, burst windows) lives in a scratch Mongo
+# database of its own for each run, dropped at the end, so live detection and
+# other backfills are not touched.
+#
+# Chunks that still fail after INSERT_ATTEMPTS are written to one
+# backfill-failed-<run>-<year>.log per year; re-feed each with --force --year.
+
+import argparse
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app import (
+    build_log_row,
+    extract_datetime,
+    is_new_line,
+    mongo_client,
+    supabase,
+    watermarks,
+)
+
+BACKFILL_DB = "major_project_backfill"
+OUT_OF_ORDER = timedelta(hours=1)
+INSERT_ATTEMPTS = 3
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line:
+                yield line
+
+
+def stamp(parsed, first_year):
+    result = []
+    skipped = 0
+    for line, dt_str, off in parsed:
+        try:
+            log_dt = datetime.strptime(
+                f"{first_year + off} {dt_str}", "%Y %b %d %H:%M:%S"
+            )
+        except ValueError:
+            skipped += 1  # Feb 29 in a non-leap year
+            continue
+        result.append((line, log_dt))
+    return result, skipped
+
+
+def assign_years(lines, first_year=None):
+    parsed = []
+    offset = 0
+    out_of_order = 0
+    skipped = 0
+    prev = None
+    for line in lines:
+        dt_str = extract_datetime(line)
+        if not dt_str:
+            skipped += 1  # Skip logs with no datetime
+            continue
+        try:
+            # 2000 is a leap year, so "Feb 29" still parses for the comparison
+            ref = datetime.strptime(f"2000 {dt_str}", "%Y %b %d %H:%M:%S")
+        except ValueError:
+            skipped += 1  # Skip logs with bad datetime
+            continue
+        if prev and prev.month >= 11 and ref.month <= 2:
+            offset += 1
+        elif prev and prev - ref > OUT_OF_ORDER:
+            out_of_order += 1
+        prev = ref
+        parsed.append((line, dt_str, offset))
+
+    if first_year is None:
+        now = datetime.now()
+        first_year = now.year - offset
+        entries, _ = stamp(parsed, first_year)
+        if entries and entries[-1][1] > now:
+            first_year -= 1
+    entries, bad_dates = stamp(parsed, first_year)
+    return entries, out_of_order, skipped + bad_dates
+
+
+def insert_chunk(rows):
+    for attempt in range(INSERT_ATTEMPTS):
+        try:
+            supabase.table("log_table").insert(rows).execute()
+            return len(rows)
+        except Exception:
+            if attempt == INSERT_ATTEMPTS - 1:
+                raise
+            time.sleep(2**attempt)
+
+
+def write_failed(run_id, rows):
+    # One file per year, sorted, so each re-feeds exactly with --year
+    by_year = {}
+    for row in rows:
+        by_year.setdefault(row["log_date"][:4], []).append(row)
+    paths = {}
+    for year, year_rows in sorted(by_year.items()):
+        year_rows.sort(key=lambda r: (r["log_date"], r["log_time"]))
+        path = f"backfill-failed-{run_id}-{year}.log"
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(r["logs"] + "\n" for r in year_rows)
+        paths[year] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--device-id", required=True)
+    parser.add_argument("--year", type=int, help="year of each file's first line")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--force", action="store_true", help="insert lines before the watermark"
+    )
+    args = parser.parse_args()
+
+    entries = []
+    for path in args.files:
+        file_entries, out_of_order, skipped = assign_years(
+            read_lines(path), args.year
+        )
+        if skipped:
+            print(f"⚠️  {path}: skipped {skipped} lines with no or a bad timestamp")
+        if out_of_order:
+            print(
+                f"⚠️  {path}: {out_of_order} backward jumps over {OUT_OF_ORDER}, "
+                "the file is not chronological so its years may be wrong"
+            )
+        entries.extend(file_entries)
+
+    if not args.force:
+        last_ts, seen = watermarks.get(args.device_id)
+        entries = [(L, dt) for L, dt in entries if is_new_line(L, dt, last_ts, seen)]
+        if last_ts:
+            print(f"Skipping lines up to the device watermark {last_ts}")
+    if not entries:
+        print("No new timestamped lines found")
+        return
+    print(f"Backfilling {len(entries)} lines")
+
+    # Per-run scratch database, so concurrent backfills don't share state
+    run_id = uuid.uuid4().hex[:8]
+    db_name = f"{BACKFILL_DB}_{run_id}"
+    db = mongo_client.get_database(db_name)
+
+    # Classification stays sequential because the Mongo windows depend on line
+    # order; full chunks are inserted in parallel while the next one is built
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            chunk = []
+            for line, log_dt in entries:
+                row = build_log_row(line, log_dt, args.device_id, now=log_dt, db=db)
+                chunk.append(row)
+                if len(chunk) >= args.chunk_size:
+                    futures.append((chunk, pool.submit(insert_chunk, chunk)))
+                    chunk = []
+            if chunk:
+                futures.append((chunk, pool.submit(insert_chunk, chunk)))
+    finally:
+        mongo_client.drop_database(db_name)
+
+    inserted = 0
+    failed = []
+    for chunk, future in futures:
+        try:
+            inserted += future.result()
+        except Exception as e:
+            print(f"❌ Chunk of {len(chunk)} rows failed: {e}")
+            failed.extend(chunk)
+
+    print(f"✅ Inserted {inserted} rows for device {args.device_id}")
+    if failed:
+        # These lines sit below the watermark later chunks advanced, so they
+        # need --force; the files hold only the failed lines
+        print(f"❌ {len(failed)} rows failed; re-feed them with:")
+        for year, path in write_failed(run_id, failed).items():
+            print(
+                f"   python3 backfill.py --force --year {year} "
+                f"--device-id {args.device_id} {path}"
+            )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
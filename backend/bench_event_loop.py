@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# bench_event_loop.py: measure event-loop lag while bcrypt hashes run concurrently
+#
+# Usage: python3 bench_event_loop.py [--hashes 16] [--threshold-ms 50]
+# Exits non-zero if the worst lag during offloaded hashing exceeds the threshold.
+
+import argparse
+import asyncio
+import sys
+import time
+
+from app import hash_password, hash_password_async
+
+TICK = 0.005
+
+
+async def watch_lag(stop, lags):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+
+
+async def run(hashes, offload):
+    stop = asyncio.Event()
+    lags = []
+    watcher = asyncio.create_task(watch_lag(stop, lags))
+    await asyncio.sleep(TICK * 2)
+
+    started = time.perf_counter()
+    if offload:
+        await asyncio.gather(
+            *(hash_password_async(f"password-{i}") for i in range(hashes))
+        )
+    else:
+        for i in range(hashes):
+            hash_password(f"password-{i}")
+            await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await watcher
+    return elapsed, max(lags) if lags else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hashes", type=int, default=16)
+    parser.add_argument("--threshold-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    for label, offload in (("inline", False), ("offloaded", True)):
+        elapsed, worst = asyncio.run(run(args.hashes, offload))
+        print(
+            f"{label:>9}: {args.hashes} hashes in {elapsed:.2f}s, "
+            f"max loop lag {worst * 1000:.1f} ms"
+        )
+
+    if worst * 1000 > args.threshold_ms:
+        print(f"❌ Offloaded lag above {args.threshold_ms} ms threshold")
+        sys.exit(1)
+    print(f"✅ Offloaded lag within {args.threshold_ms} ms threshold")
+
+
+if __name__ == "__main__":
+    main()
@@ -52,8 +52,8 @@ send_new_logs() {
        {
          # parse month, day, time from line
          month=$1; day=sprintf("%02d", $2); time=$3;
-         iso = year "-" m[month] "-" day "T" time;
-         if (iso > last) print $0;
+         iso = year "-" m[month] "-" day " " time;
+         if (iso >= last) print $0;
        }' /var/log/linux.log | \
   curl -s -X POST "$BASE_URL/ingest_logs" \
     -H "Content-Type: text/plain" \